@@ -5,14 +5,20 @@ from datetime import datetime
 import logging
 import hashlib
 import uuid
+import threading
+import importlib
 from optparse import OptionParser
-from http.server import HTTPServer, BaseHTTPRequestHandler
-from dateutil import relativedelta as rdelta
+from http.server import BaseHTTPRequestHandler
 
-from store import StorageRedis
-from scoring import get_score, get_interests
+from scoring import get_score, get_interests_many, load_model, ModelReloader
+from warmup import warm_up, WARMUP_PREFIXES
+from server import GracefulHTTPServer, notify_parent_ready, fork_workers
 from config import *
 
+# Тяжелые модули импортируются лениво, при первом использовании.
+# В режиме нескольких воркеров мастер загружает их до fork, чтобы воркеры делили память
+PRELOAD_MODULES = ('dateutil.relativedelta', 'redis', 'store', 'interests')
+
 
 
 class Field:
@@ -104,6 +110,7 @@ class BirthDayField(DateField):
     def __set__(self, instance, value):
         super().__set__(instance, value)
         if value:
+            from dateutil import relativedelta as rdelta
             now_date = datetime.now()
             value_date = self.valid_date(value)
             delta = rdelta.relativedelta(now_date, value_date)
@@ -266,8 +273,8 @@ def clients_interests(methodrequest, ctx, store):
         return clientsInterests.errors, INVALID_REQUEST
     ctx['nclients'] = len(clientsInterests.client_ids)
     answer = {}
-    for client_id in clientsInterests.client_ids:
-        answer['client_id%s' % client_id] = get_interests(store, client_id)
+    for client_id, interests in get_interests_many(store, clientsInterests.client_ids):
+        answer['client_id%s' % client_id] = interests
     return answer, OK
 
 
@@ -297,27 +304,85 @@ class MainHTTPHandler(BaseHTTPRequestHandler):
     router = {
         "method": method_handler
     }
-    store = StorageRedis(host=REDIS_HOST,
-                         port=REDIS_PORT,
-                         timeout_connection=TIMEOUT_CONNECTION,
-                         retry_connection=RETRY_CONNECTION)
+    # Хранилище создается один раз из параметров запуска, см. create_store
+    store = None
+    # Готовность принимать трафик, выставляется после прогрева кэша
+    ready = threading.Event()
+    max_body_size = MAX_BODY_SIZE
+    max_discard_size = MAX_DISCARD_SIZE
+    # Переиспользуемый буфер для тела запроса, свой в каждом потоке
+    buffers = threading.local()
 
     def get_request_id(self, headers):
         return headers.get('HTTP_X_REQUEST_ID', uuid.uuid4().hex)
 
+    def do_GET(self):
+        # Проверка готовности для балансировщика: 503 пока идет прогрев
+        if self.path.strip("/") != "ready":
+            code = NOT_FOUND
+            r = {"error": ERRORS[code], "code": code}
+        elif self.ready.is_set():
+            code = OK
+            r = {"response": {"ready": True}, "code": code}
+        else:
+            code = SERVICE_UNAVAILABLE
+            r = {"error": ERRORS[code], "code": code}
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.end_headers()
+        self.wfile.write(json.dumps(r).encode())
+
+    def read_body(self, length):
+        # Читаем тело в заранее выделенный bytearray без промежуточных копий bytes
+        buffer = getattr(self.buffers, 'data', None)
+        if buffer is None or len(buffer) < length:
+            buffer = self.buffers.data = bytearray(max(length, 64 * 1024))
+        view = memoryview(buffer)[:length]
+        read = 0
+        while read < length:
+            n = self.rfile.readinto(view[read:])
+            if not n:
+                raise ValueError('Unexpected end of request body')
+            read += n
+        return view
+
+    def discard_body(self, length):
+        # Вычитываем слишком большое тело, иначе клиент, который еще пишет, получит EPIPE вместо 413
+        buffer = getattr(self.buffers, 'data', None)
+        if buffer is None:
+            buffer = self.buffers.data = bytearray(64 * 1024)
+        view = memoryview(buffer)
+        while length > 0:
+            n = self.rfile.readinto(view[:min(length, len(view))])
+            if not n:
+                break
+            length -= n
+
     def do_POST(self):
         response, code = {}, OK
         context = {"request_id": self.get_request_id(self.headers)}
         request = None
+        length = None
         try:
-            data_string = self.rfile.read(int(self.headers['Content-Length']))
-            request = json.loads(data_string)
-        except:
+            length = int(self.headers['Content-Length'])
+        except (TypeError, ValueError):
             code = BAD_REQUEST
+        if length is not None and (length < 0 or length > self.max_body_size):
+            # Тело в обработку не берем, соединение закрываем
+            code = BAD_REQUEST if length < 0 else REQUEST_ENTITY_TOO_LARGE
+            if length <= self.max_discard_size:
+                self.discard_body(length)
+            self.close_connection = True
+        elif length is not None:
+            try:
+                with self.read_body(length) as view:
+                    request = json.loads(str(view, 'utf-8'))
+            except Exception:
+                code = BAD_REQUEST
 
         if request:
             path = self.path.strip("/")
-            logging.info("%s: %s %s" % (self.path, data_string, context["request_id"]))
+            logging.info("%s: %s bytes %s" % (self.path, length, context["request_id"]))
             if path in self.router:
                 try:
                     response, code = self.router[path]({"body": request, "headers": self.headers}, context, self.store)
@@ -336,11 +401,32 @@ class MainHTTPHandler(BaseHTTPRequestHandler):
             r = {"error": response or ERRORS.get(code, "Unknown Error"), "code": code}
         context.update(r)
         logging.info(context)
-        self.wfile.write(json.dumps(r))
+        self.wfile.write(json.dumps(r).encode())
         return
 
 
-if __name__ == "__main__":
+def preload():
+    for name in PRELOAD_MODULES:
+        importlib.import_module(name)
+
+
+def create_store(opts):
+    from store import StorageRedis, StorageRedisSharded
+    if opts.redis_nodes:
+        return StorageRedisSharded(nodes=opts.redis_nodes,
+                                   timeout_connection=opts.timeout_connection,
+                                   retry_connection=opts.retry_connection,
+                                   local_cache_ttl=opts.local_cache_ttl,
+                                   local_cache_size=opts.local_cache_size)
+    return StorageRedis(host=opts.redis_host,
+                        port=opts.redis_port,
+                        timeout_connection=opts.timeout_connection,
+                        retry_connection=opts.retry_connection,
+                        local_cache_ttl=opts.local_cache_ttl,
+                        local_cache_size=opts.local_cache_size)
+
+
+def parse_options(argv=None):
     op = OptionParser()
     op.add_option("-p", "--port", action="store", type=int, default=8080)
     op.add_option("-l", "--log", action="store", default=None)
@@ -348,19 +434,92 @@ if __name__ == "__main__":
     op.add_option("--redis-port", action="store", type=int, default=6379)
     op.add_option("--retry-connection", action="store", type=int, default=3)
     op.add_option("--timeout-connection", action="store", type=int, default=20)
-    (opts, args) = op.parse_args()
-
-    REDIS_HOST = opts.redis_host
-    REDIS_PORT = opts.redis_port
-    RETRY_CONNECTION = opts.retry_connection
-    TIMEOUT_CONNECTION = opts.timeout_connection
-
+    op.add_option("--redis-node", action="append", dest="redis_nodes", default=None,
+                  help="host:port[,replica_host:replica_port...], repeat for every shard")
+    op.add_option("--local-cache-ttl", action="store", type=int, default=None)
+    op.add_option("--local-cache-size", action="store", type=int, default=LOCAL_CACHE_SIZE,
+                  help="max entries of the in-process cache, warm-up reads no more keys than that")
+    op.add_option("--scoring-model", action="store", default=None)
+    op.add_option("--scoring-model-reload-interval", action="store", type=float, default=5)
+    op.add_option("--max-body-size", action="store", type=int, default=MAX_BODY_SIZE)
+    op.add_option("--write-behind-queue", action="store", type=int, default=0)
+    op.add_option("--write-behind-batch", action="store", type=int, default=100)
+    op.add_option("--write-behind-interval", action="store", type=float, default=0.05)
+    op.add_option("--warmup-prefix", action="append", dest="warmup_prefixes", default=None)
+    op.add_option("--warmup-snapshot", action="store", default=None)
+    op.add_option("--reuse-port", action="store_true", default=False)
+    op.add_option("-w", "--workers", action="store", type=int, default=1)
+    (opts, args) = op.parse_args(argv)
+    if opts.workers < 1:
+        op.error('--workers must be positive')
+    if opts.local_cache_size < 1:
+        op.error('--local-cache-size must be positive')
+    return opts
+
+
+def check_options(opts):
+    # Ошибки конфигурации проверяются в мастере до fork, а не в каждом воркере
+    from store import parse_node
+    if opts.scoring_model:
+        try:
+            load_model(opts.scoring_model)
+        except (OSError, ValueError) as e:
+            raise SystemExit('Cannot load scoring model %s: %s' % (opts.scoring_model, e))
+    for node in opts.redis_nodes or []:
+        addresses = [address.strip() for address in node.split(',') if address.strip()]
+        try:
+            if not addresses:
+                raise ValueError('no addresses')
+            for address in addresses:
+                parse_node(address)
+        except ValueError as e:
+            raise SystemExit('Invalid redis node %r: %s' % (node, e))
+
+
+def run_worker(server, opts, notify_parent=True):
+    # Все, что держит соединения и потоки, создается в самом воркере, уже после fork
+    server.install_signal_handlers(restart=opts.workers == 1)
+    MainHTTPHandler.store = create_store(opts)
+    MainHTTPHandler.max_body_size = opts.max_body_size
+    if opts.scoring_model:
+        model_reloader = ModelReloader(opts.scoring_model, interval=opts.scoring_model_reload_interval)
+        if not model_reloader.reload():
+            raise SystemExit('Cannot load scoring model %s' % opts.scoring_model)
+        model_reloader.start()
+        server.on_drain.append(model_reloader.stop)
+    if opts.write_behind_queue:
+        from store import WriteBehind
+        write_behind = WriteBehind(MainHTTPHandler.store, max_size=opts.write_behind_queue,
+                                   batch_size=opts.write_behind_batch, flush_interval=opts.write_behind_interval)
+        write_behind.start()
+        # дописываем в Redis все, что осталось в очереди
+        server.on_drain.append(write_behind.stop)
+
+    def run_warm_up():
+        warm_up(MainHTTPHandler.store, prefixes=opts.warmup_prefixes or WARMUP_PREFIXES,
+                snapshot=opts.warmup_snapshot)
+        MainHTTPHandler.ready.set()
+        if notify_parent:
+            notify_parent_ready()
+    threading.Thread(target=run_warm_up, daemon=True).start()
+    server.serve()
+
+
+def main(argv=None):
+    opts = parse_options(argv)
     logging.basicConfig(filename=opts.log, level=logging.INFO,
                         format='[%(asctime)s] %(levelname).1s %(message)s', datefmt='%Y.%m.%d %H:%M:%S')
-    server = HTTPServer(("localhost", opts.port), MainHTTPHandler)
+    server = GracefulHTTPServer(("localhost", opts.port), MainHTTPHandler, reuse_port=opts.reuse_port)
+    server.ready = MainHTTPHandler.ready
     logging.info("Starting server at %s" % opts.port)
-    try:
-        server.serve_forever()
-    except KeyboardInterrupt:
-        pass
-    server.server_close()
+    if opts.workers == 1:
+        run_worker(server, opts)
+        return
+    check_options(opts)
+    preload()
+    # о готовности предыдущему мастеру сообщает только первый воркер
+    fork_workers(server, opts.workers, lambda number: run_worker(server, opts, notify_parent=number == 0))
+
+
+if __name__ == "__main__":
+    main()
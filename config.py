@@ -1,7 +1,7 @@
-REDIS_HOST = ''
-REDIS_PORT = None
-RETRY_CONNECTION = None
-TIMEOUT_CONNECTION = None
+MAX_BODY_SIZE = 1024 * 1024
+# Тело больше MAX_BODY_SIZE, но не больше MAX_DISCARD_SIZE, вычитывается, чтобы клиент получил 413
+MAX_DISCARD_SIZE = 16 * 1024 * 1024
+LOCAL_CACHE_SIZE = 100000
 
 SALT = "Otus"
 ADMIN_LOGIN = "admin"
@@ -10,14 +10,18 @@ OK = 200
 BAD_REQUEST = 400
 FORBIDDEN = 403
 NOT_FOUND = 404
+REQUEST_ENTITY_TOO_LARGE = 413
 INVALID_REQUEST = 422
 INTERNAL_ERROR = 500
+SERVICE_UNAVAILABLE = 503
 ERRORS = {
     BAD_REQUEST: "Bad Request",
     FORBIDDEN: "Forbidden",
     NOT_FOUND: "Not Found",
+    REQUEST_ENTITY_TOO_LARGE: "Request Entity Too Large",
     INVALID_REQUEST: "Invalid Request",
     INTERNAL_ERROR: "Internal Server Error",
+    SERVICE_UNAVAILABLE: "Service Unavailable",
 }
 UNKNOWN = 0
 MALE = 1
@@ -0,0 +1,230 @@
+"""Детерминированная замена Redis для нагрузочных тестов и бенчмарков retry/батчинга на одной машине.
+
+FaultyRedis реализует используемую StorageRedis часть клиента redis.Redis (get, set, delete,
+scan_iter, pipeline с get/set/ttl/sadd/expire/smembers) поверх словаря в памяти и умеет вносить задержки, ошибки, таймауты и partition.
+Все случайные величины берутся из random.Random(seed), время - из FakeClock или реальное.
+
+    store = FakeStorageRedis(seed=1, latency={'get': ('uniform', 0.001, 0.005)}, error_rate={'get': 0.1})
+    get_score(store, phone="79175002040", email="otus@mail.ru")
+"""
+import time
+import random
+import fnmatch
+import threading
+
+from redis.exceptions import ConnectionError, TimeoutError, ResponseError
+
+from store import StorageRedis
+
+WRONGTYPE = 'WRONGTYPE Operation against a key holding the wrong kind of value'
+
+
+class FakeClock:
+    # Виртуальное время: sleep не ждет, а сдвигает now, бенчмарк проходит мгновенно и воспроизводимо
+
+    def __init__(self):
+        self.now = 0.0
+        self.lock = threading.Lock()
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        with self.lock:
+            self.now += seconds
+
+
+class RealClock:
+
+    def time(self):
+        return time.monotonic()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+
+class FaultyRedis:
+    """Redis в памяти с внесением отказов.
+
+    latency - {операция: (распределение, *параметры)}, распределение - 'constant', 'uniform',
+              'gauss' или 'expovariate' (метод random.Random), операция '*' - для всех остальных.
+    error_rate - {операция: вероятность ConnectionError}.
+    timeout_rate - {операция: вероятность таймаута}, таймаут ждет socket_timeout и кидает TimeoutError.
+    Операция pipeline - один запрос на весь pipeline.
+    """
+
+    def __init__(self, seed=0, latency=None, error_rate=None, timeout_rate=None, socket_timeout=1.0, clock=None):
+        self.random = random.Random(seed)
+        self.latency = latency or {}
+        self.error_rate = error_rate or {}
+        self.timeout_rate = timeout_rate or {}
+        self.socket_timeout = socket_timeout
+        self.clock = clock or FakeClock()
+        self.data = {}
+        self.partitioned_until = None
+        self.lock = threading.Lock()
+        self.stats = {'calls': {}, 'errors': 0, 'timeouts': 0, 'latency': 0.0}
+
+    def partition(self, duration=None):
+        # Узел недоступен duration секунд по часам clock, None - до heal()
+        self.partitioned_until = float('inf') if duration is None else self.clock.time() + duration
+
+    def heal(self):
+        self.partitioned_until = None
+
+    def sample(self, table, op):
+        return table.get(op, table.get('*'))
+
+    def request(self, op):
+        # Один сетевой запрос: задержка, затем возможный отказ
+        with self.lock:
+            self.stats['calls'][op] = self.stats['calls'].get(op, 0) + 1
+            spec = self.sample(self.latency, op)
+            delay = 0.0
+            if spec:
+                distribution, params = spec[0], spec[1:]
+                delay = params[0] if distribution == 'constant' else getattr(self.random, distribution)(*params)
+                delay = max(delay, 0.0)
+            failed = self.random.random() < (self.sample(self.error_rate, op) or 0)
+            timed_out = self.random.random() < (self.sample(self.timeout_rate, op) or 0)
+            partitioned = self.partitioned_until is not None and self.clock.time() < self.partitioned_until
+            if partitioned or failed:
+                self.stats['errors'] += 1
+            elif timed_out:
+                self.stats['timeouts'] += 1
+            else:
+                self.stats['latency'] += delay
+        if partitioned:
+            raise ConnectionError('Fake Redis partitioned')
+        if timed_out and not failed:
+            self.clock.sleep(self.socket_timeout)
+            raise TimeoutError('Fake Redis timeout')
+        self.clock.sleep(delay)
+        if failed:
+            raise ConnectionError('Fake Redis connection error')
+
+    def _lookup(self, name):
+        # Значение любого типа: bytes для строк, set для множеств
+        item = self.data.get(name)
+        if item is None:
+            return None
+        value, expire_at = item
+        if expire_at is not None and expire_at <= self.clock.time():
+            del self.data[name]
+            return None
+        return value
+
+    def _get(self, name):
+        value = self._lookup(name)
+        if value is not None and not isinstance(value, bytes):
+            raise ResponseError(WRONGTYPE)
+        return value
+
+    def _set(self, name, value, ex=None):
+        if not isinstance(value, bytes):
+            value = str(value).encode()
+        self.data[name] = (value, self.clock.time() + ex if ex else None)
+        return True
+
+    def _sadd(self, name, *values):
+        members = self._smembers(name)
+        expire_at = self.data[name][1] if name in self.data else None
+        added = {value if isinstance(value, bytes) else str(value).encode() for value in values} - members
+        self.data[name] = (members | added, expire_at)
+        return len(added)
+
+    def _expire(self, name, time):
+        if self._lookup(name) is None:
+            return False
+        self.data[name] = (self.data[name][0], self.clock.time() + time)
+        return True
+
+    def _ttl(self, name):
+        if self._lookup(name) is None:
+            return -2
+        expire_at = self.data[name][1]
+        return -1 if expire_at is None else int(expire_at - self.clock.time() + 0.5)
+
+    def _smembers(self, name):
+        value = self._lookup(name)
+        if isinstance(value, bytes):
+            raise ResponseError(WRONGTYPE)
+        return set(value or ())
+
+    def get(self, name):
+        self.request('get')
+        return self._get(name)
+
+    def set(self, name, value, ex=None, nx=False):
+        self.request('set')
+        if nx and self._lookup(name) is not None:
+            return None
+        return self._set(name, value, ex)
+
+    def delete(self, *names):
+        self.request('delete')
+        return sum(self.data.pop(name, None) is not None for name in names)
+
+    def scan_iter(self, match=None, count=None):
+        self.request('scan')
+        for name in list(self.data):
+            if (match is None or fnmatch.fnmatchcase(name, match)) and self._lookup(name) is not None:
+                yield name.encode()
+
+    def pipeline(self, transaction=True):
+        return FaultyPipeline(self)
+
+
+class FaultyPipeline:
+
+    def __init__(self, client):
+        self.client = client
+        self.commands = []
+
+    def get(self, name):
+        self.commands.append((self.client._get, (name,), {}))
+        return self
+
+    def set(self, name, value, ex=None):
+        self.commands.append((self.client._set, (name, value), {'ex': ex}))
+        return self
+
+    def sadd(self, name, *values):
+        self.commands.append((self.client._sadd, (name,) + values, {}))
+        return self
+
+    def expire(self, name, time):
+        self.commands.append((self.client._expire, (name, time), {}))
+        return self
+
+    def ttl(self, name):
+        self.commands.append((self.client._ttl, (name,), {}))
+        return self
+
+    def smembers(self, name):
+        self.commands.append((self.client._smembers, (name,), {}))
+        return self
+
+    def execute(self):
+        commands, self.commands = self.commands, []
+        self.client.request('pipeline')
+        # как redis-py: выполняются все команды, затем поднимается первая ошибка ответа
+        results = []
+        for command, args, kwargs in commands:
+            try:
+                results.append(command(*args, **kwargs))
+            except ResponseError as e:
+                results.append(e)
+        for result in results:
+            if isinstance(result, ResponseError):
+                raise result
+        return results
+
+
+class FakeStorageRedis(StorageRedis):
+    # StorageRedis с настоящими reconnect/cache-семантиками поверх FaultyRedis
+
+    def __init__(self, retry_connection=3, local_cache_ttl=None, local_cache_size=100000, **fault_options):
+        super().__init__(retry_connection=retry_connection, local_cache_ttl=local_cache_ttl,
+                         local_cache_size=local_cache_size)
+        self.redis = FaultyRedis(**fault_options)
@@ -0,0 +1,133 @@
+"""Компактное хранение интересов клиентов.
+
+Вместо JSON-списка строк под ключом i:<cid> хранятся номера интересов в общем словаре:
+'#<версия словаря>:<номера hex>', каждый номер - hex фиксированной для версии ширины, порядок
+и повторы списка сохраняются. Словари версионируются и только дополняются, каждая версия лежит
+в store под ключом interests:dict:<версия>, номер текущей версии - под interests:dict:version.
+
+Миграция существующих ключей:
+
+    python interests.py --redis-host 127.0.0.1 --redis-port 6379 --encode
+"""
+import json
+import logging
+import functools
+from optparse import OptionParser
+
+ENCODED_PREFIX = '#'
+DICT_KEY = 'interests:dict:%s'
+DICT_VERSION_KEY = 'interests:dict:version'
+MIGRATE_BATCH_SIZE = 500
+
+# version -> tuple интересов, словари неизменяемы, поэтому кэшируются в процессе навсегда
+_dictionaries = {}
+
+
+def load_dictionary(store, version):
+    if version not in _dictionaries:
+        value = store.get(DICT_KEY % version)
+        if value is None:
+            raise KeyError('Interests dictionary version %s not found' % version)
+        _dictionaries[version] = tuple(json.loads(value))
+    return _dictionaries[version]
+
+
+def current_version(store):
+    # interests:dict:version - подсказка, последняя версия ищется по существующим словарям
+    version = store.get(DICT_VERSION_KEY)
+    version = int(version) if version else 0
+    while store.get(DICT_KEY % (version + 1)) is not None:
+        version += 1
+    return version
+
+
+def publish_dictionary(store, interests):
+    """Добавляет новые интересы в конец текущего словаря и публикует новую версию.
+    Версия занимается через SET NX, при гонке с другой миграцией словарь перечитывается.
+    Возвращает (версия, словарь)."""
+    while True:
+        version = current_version(store)
+        dictionary = load_dictionary(store, version) if version else ()
+        new = sorted(set(interests) - set(dictionary))
+        if not new:
+            return version, dictionary
+        dictionary = dictionary + tuple(new)
+        if store.set_nx(DICT_KEY % (version + 1), json.dumps(dictionary)):
+            store.set(DICT_VERSION_KEY, version + 1)
+            _dictionaries[version + 1] = dictionary
+            return version + 1, dictionary
+        logging.info('Interests dictionary version %s already published, retrying' % (version + 1))
+
+
+def index_width(dictionary):
+    # Число hex-символов на номер интереса: 1 для словаря до 16 интересов, 2 - до 256 и т.д.
+    return len('%x' % max(len(dictionary) - 1, 0))
+
+
+def encode(interests, version, dictionary):
+    index = {name: i for i, name in enumerate(dictionary)}
+    width = index_width(dictionary)
+    return '%s%s:%s' % (ENCODED_PREFIX, version, ''.join('%0*x' % (width, index[name]) for name in interests))
+
+
+@functools.lru_cache(maxsize=4096)
+def _decode_indexes(dictionary, indexes):
+    width = index_width(dictionary)
+    return tuple(dictionary[int(indexes[i:i + width], 16)] for i in range(0, len(indexes), width))
+
+
+def decode(store, value):
+    # Прозрачно понимает оба формата: номера по словарю и старый JSON-список
+    if not value:
+        return []
+    if not value.startswith(ENCODED_PREFIX):
+        return json.loads(value)
+    version, _, indexes = value[len(ENCODED_PREFIX):].partition(':')
+    return list(_decode_indexes(load_dictionary(store, int(version)), indexes))
+
+
+def migrate(store, batch_size=MIGRATE_BATCH_SIZE, to_encoded=True):
+    """Перекодирует все ключи i:<cid> в компактный формат (или обратно в JSON при to_encoded=False).
+    Возвращает число перезаписанных ключей."""
+    keys = store.scan_keys('i:')
+    version, dictionary = current_version(store), ()
+    if to_encoded:
+        vocabulary = set()
+        for i in range(0, len(keys), batch_size):
+            for value in store.get_many(keys[i:i + batch_size]):
+                vocabulary.update(decode(store, value))
+        version, dictionary = publish_dictionary(store, vocabulary)
+    migrated = 0
+    for i in range(0, len(keys), batch_size):
+        batch = keys[i:i + batch_size]
+        items = []
+        # значения читаются вместе с TTL, чтобы перезапись не снимала срок жизни ключа
+        for key, (value, ttl) in zip(batch, store.get_many_ttl(batch)):
+            if not value or value.startswith(ENCODED_PREFIX) == to_encoded:
+                continue
+            interests = decode(store, value)
+            if to_encoded and not set(interests) <= set(dictionary):
+                # ключ изменился после первого прохода
+                version, dictionary = publish_dictionary(store, interests)
+            new_value = encode(interests, version, dictionary) if to_encoded else json.dumps(interests)
+            items.append((key, new_value, ttl))
+        if items:
+            store.set_many(items)
+            migrated += len(items)
+    logging.info('Migrated %s interests keys' % migrated)
+    return migrated
+
+
+if __name__ == "__main__":
+    from store import StorageRedis
+    op = OptionParser()
+    op.add_option("-r", "--redis-host", action="store", default='127.0.0.1')
+    op.add_option("--redis-port", action="store", type=int, default=6379)
+    op.add_option("--batch-size", action="store", type=int, default=MIGRATE_BATCH_SIZE)
+    op.add_option("--encode", action="store_true", dest="to_encoded", default=True)
+    op.add_option("--decode", action="store_false", dest="to_encoded")
+    (opts, args) = op.parse_args()
+    logging.basicConfig(level=logging.INFO,
+                        format='[%(asctime)s] %(levelname).1s %(message)s', datefmt='%Y.%m.%d %H:%M:%S')
+    migrate(StorageRedis(host=opts.redis_host, port=opts.redis_port),
+            batch_size=opts.batch_size, to_encoded=opts.to_encoded)
@@ -0,0 +1,111 @@
+"""Предрасчет скоров известных клиентов и инкрементальная инвалидация по данным из CRM.
+
+Файл клиентов - JSON lines с полями online_score: phone, email, birthday (DD.MM.YYYY),
+gender, first_name, last_name. Старые скоры клиентов сбрасываются по индексам телефона и email,
+после чего считаются заново и кладутся в кэш:
+
+    python precompute.py -r 127.0.0.1 --redis-port 6379 --customers customers.jsonl
+"""
+import json
+import queue
+import logging
+import threading
+from datetime import datetime
+from optparse import OptionParser
+
+from scoring import get_score, invalidate_scores, SCORE_FIELDS
+
+PRECOMPUTE_BATCH_SIZE = 100
+
+
+def customer_arguments(customer):
+    arguments = {field: customer.get(field) for field in SCORE_FIELDS}
+    if arguments['phone'] is not None:
+        arguments['phone'] = str(arguments['phone'])
+    if arguments['birthday']:
+        arguments['birthday'] = datetime.strptime(arguments['birthday'], "%d.%m.%Y")
+    return arguments
+
+
+def refresh_scores(store, customers):
+    """Сбрасывает кэш скоров customers и считает их заново. Возвращает число удаленных ключей."""
+    customers = [customer_arguments(customer) for customer in customers]
+    removed = invalidate_scores(store, customers)
+    for customer in customers:
+        get_score(store, **customer)
+    return removed
+
+
+class ScorePrecomputer(threading.Thread):
+    # Фоновый пересчет: submit кладет клиента в ограниченную очередь, поток обрабатывает их пачками
+
+    def __init__(self, store, batch_size=PRECOMPUTE_BATCH_SIZE, max_size=10000):
+        super().__init__(daemon=True)
+        self.store = store
+        self.batch_size = batch_size
+        self.queue = queue.Queue(maxsize=max_size)
+        self.dropped = 0
+        self.refreshed = 0
+        self.stopped = threading.Event()
+
+    def submit(self, customer):
+        try:
+            self.queue.put_nowait(customer)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def take_batch(self, timeout):
+        batch = []
+        try:
+            batch.append(self.queue.get(timeout=timeout))
+            while len(batch) < self.batch_size:
+                batch.append(self.queue.get_nowait())
+        except queue.Empty:
+            pass
+        return batch
+
+    def process(self, batch):
+        try:
+            refresh_scores(self.store, batch)
+            self.refreshed += len(batch)
+        except Exception as e:
+            logging.exception('Scores precompute failed: %s' % e)
+
+    def run(self):
+        while not self.stopped.is_set():
+            batch = self.take_batch(0.1)
+            if batch:
+                self.process(batch)
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        batch = self.take_batch(0)
+        while batch:
+            self.process(batch)
+            batch = self.take_batch(0)
+
+
+if __name__ == "__main__":
+    from store import StorageRedis
+    op = OptionParser()
+    op.add_option("-r", "--redis-host", action="store", default='127.0.0.1')
+    op.add_option("--redis-port", action="store", type=int, default=6379)
+    op.add_option("--customers", action="store", default=None)
+    op.add_option("--batch-size", action="store", type=int, default=PRECOMPUTE_BATCH_SIZE)
+    (opts, args) = op.parse_args()
+    logging.basicConfig(level=logging.INFO,
+                        format='[%(asctime)s] %(levelname).1s %(message)s', datefmt='%Y.%m.%d %H:%M:%S')
+    if not opts.customers:
+        op.error('--customers is required')
+    precomputer = ScorePrecomputer(StorageRedis(host=opts.redis_host, port=opts.redis_port),
+                                   batch_size=opts.batch_size, max_size=0)
+    precomputer.start()
+    with open(opts.customers) as f:
+        for line in f:
+            if line.strip():
+                precomputer.submit(json.loads(line))
+    precomputer.stop()
+    logging.info('Refreshed scores of %s customers' % precomputer.refreshed)
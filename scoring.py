@@ -1,33 +1,175 @@
-import hashlib
+import os
 import json
+import hashlib
+import logging
+import itertools
+import threading
+
+import interests
+
+INTERESTS_BATCH_SIZE = 500
+SCORE_FIELDS = ('phone', 'email', 'birthday', 'gender', 'first_name', 'last_name')
+DEFAULT_MODEL = {
+    "version": "1",
+    "rules": [
+        {"fields": ["phone"], "weight": 1.5},
+        {"fields": ["email"], "weight": 1.5},
+        {"fields": ["birthday", "gender"], "weight": 1.5},
+        {"fields": ["first_name", "last_name"], "weight": 0.5},
+    ]
+}
+
+
+class ScoringModel:
+    """Табличная модель скоринга: правило добавляет weight, если все его fields не пустые.
+
+    Конфиг - JSON {"version": "...", "rules": [{"fields": [...], "weight": ...}, ...]}.
+    Правила компилируются в кортеж (индексы полей, вес) для быстрого вычисления.
+    cache_version - версия вместе с хэшем правил, меняется при любой смене правил.
+    """
+
+    def __init__(self, config):
+        if not isinstance(config, dict):
+            raise ValueError('Invalid scoring model, config must be an object')
+        self.version = str(config.get('version') or '')
+        if not self.version:
+            raise ValueError('Invalid scoring model, version is required')
+        if not isinstance(config.get('rules', []), list):
+            raise ValueError('Invalid scoring model, rules must be a list')
+        rules = []
+        for rule in config.get('rules', []):
+            if not isinstance(rule, dict):
+                raise ValueError('Invalid scoring model rule: {}'.format(rule))
+            fields = rule.get('fields')
+            if not isinstance(fields, list) or not fields or any(field not in SCORE_FIELDS for field in fields):
+                raise ValueError('Invalid scoring model rule fields: {}'.format(fields))
+            weight = rule.get('weight')
+            if isinstance(weight, bool) or not isinstance(weight, (int, float)):
+                raise ValueError('Invalid scoring model rule weight: {}'.format(weight))
+            rules.append((tuple(SCORE_FIELDS.index(field) for field in fields), weight))
+        self.rules = tuple(rules)
+        self.cache_version = '%s-%s' % (self.version, hashlib.md5(repr(self.rules).encode()).hexdigest()[:8])
+
+    def score(self, *values):
+        # values - значения в порядке SCORE_FIELDS
+        score = 0
+        for indexes, weight in self.rules:
+            if all(values[i] for i in indexes):
+                score += weight
+        return score
+
+
+def load_model(path):
+    with open(path) as f:
+        return ScoringModel(json.load(f))
+
+
+_model = ScoringModel(DEFAULT_MODEL)
+
+
+def get_model():
+    return _model
+
 
+def set_model(model):
+    # Замена ссылки атомарна, запросы в процессе дорабатывают со старой моделью
+    global _model
+    _model = model
+    logging.info('Scoring model version %s activated' % model.version)
 
-def get_score(store, phone, email, birthday=None, gender=None, first_name=None, last_name=None):
+
+class ModelReloader(threading.Thread):
+    # Следит за mtime файла модели и подменяет модель при его изменении
+
+    def __init__(self, path, interval=5):
+        super().__init__(daemon=True)
+        self.path = path
+        self.interval = interval
+        self.mtime = None
+        self.stopped = threading.Event()
+
+    def reload(self):
+        try:
+            mtime = os.stat(self.path).st_mtime
+            if mtime == self.mtime:
+                return False
+            model = load_model(self.path)
+        except (OSError, ValueError) as e:
+            logging.error('Scoring model reload failed: %s' % e)
+            return False
+        self.mtime = mtime
+        current = get_model()
+        if model.version == current.version and model.rules != current.rules:
+            # ключи кэша все равно разные, но версию модели стоит поднимать при смене правил
+            logging.warning('Scoring model rules changed but version %s did not' % model.version)
+        set_model(model)
+        return True
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.reload()
+            except Exception as e:
+                logging.exception('Scoring model reload failed: %s' % e)
+
+    def stop(self):
+        self.stopped.set()
+
+
+def score_index_keys(phone=None, email=None):
+    # Вторичные индексы: по телефону и email находятся все закэшированные uid: ключи человека
+    keys = []
+    if phone:
+        keys.append("idx:phone:%s" % phone)
+    if email:
+        keys.append("idx:email:%s" % email.lower())
+    return keys
+
+
+def invalidate_scores(store, customers):
+    """Сбрасывает закэшированные скоры всех customers (словари с phone и/или email)
+    одним пакетом. Возвращает число удаленных uid: ключей."""
+    index_keys = set()
+    for customer in customers:
+        index_keys.update(score_index_keys(customer.get('phone'), customer.get('email')))
+    return store.invalidate(sorted(index_keys))
+
+
+def get_score(store, phone, email, birthday=None, gender=None, first_name=None, last_name=None, model=None):
+    model = model or _model
     key_parts = [
         first_name or "",
         last_name or "",
         phone or "",
         birthday.strftime("%Y%m%d") if birthday is not None else "",
+        email or "",
+        str(gender) if gender is not None else "",
     ]
-    key = "uid:" + hashlib.md5("".join(key_parts).encode()).hexdigest()
+    # версия и хэш правил модели в ключе: после смены модели старые значения из кэша не используются,
+    # в том числе записанные другими процессами
+    key = "uid:%s:%s" % (model.cache_version, hashlib.md5("|".join(key_parts).encode()).hexdigest())
     # try get from cache,
     # fallback to heavy calculation in case of cache miss
     score = store.cache_get(key) or 0
     if score:
         return score
-    if phone:
-        score += 1.5
-    if email:
-        score += 1.5
-    if birthday and gender:
-        score += 1.5
-    if first_name and last_name:
-        score += 0.5
+    score = model.score(phone, email, birthday, gender, first_name, last_name)
     # cache for 60 minutes
-    store.cache_set(key, score, 60 * 60)
+    store.cache_set(key, score, 60 * 60, index_keys=score_index_keys(phone, email))
     return score
 
 
 def get_interests(store, cid):
     r = store.get("i:%s" % cid)
-    return json.loads(r) if r else []
+    return interests.decode(store, r)
+
+
+def get_interests_many(store, cids, batch_size=INTERESTS_BATCH_SIZE):
+    # Пакетное чтение интересов: один pipeline на batch_size клиентов
+    cids = iter(cids)
+    batch = list(itertools.islice(cids, batch_size))
+    while batch:
+        values = store.get_many(["i:%s" % cid for cid in batch])
+        for cid, r in zip(batch, values):
+            yield cid, interests.decode(store, r)
+        batch = list(itertools.islice(cids, batch_size))
@@ -0,0 +1,179 @@
+import os
+import sys
+import signal
+import socket
+import logging
+import time
+import threading
+from http.server import HTTPServer
+
+# Дескриптор слушающего сокета, унаследованный от предыдущего процесса
+LISTEN_FD_ENV = 'SCORING_LISTEN_FD'
+# pid предыдущего процесса, которому новый сообщает о готовности
+PARENT_PID_ENV = 'SCORING_PARENT_PID'
+# Сигналы остановки, до установки обработчиков в воркере они блокируются
+STOP_SIGNALS = (signal.SIGTERM, signal.SIGINT)
+# Код выхода воркера, который не смог запуститься: перезапуск бесполезен, мастер останавливается
+WORKER_STARTUP_FAILED = 2
+
+
+class GracefulHTTPServer(HTTPServer):
+    """HTTPServer с плавной остановкой и передачей слушающего сокета новому процессу.
+
+    SIGTERM/SIGINT - перестать принимать соединения, дождаться текущего запроса и выполнить on_drain.
+    SIGHUP - запустить новый процесс с тем же сокетом; когда он прогреется, он пришлет SIGTERM.
+    """
+
+    def __init__(self, server_address, handler_class, reuse_port=False):
+        self.reuse_port = reuse_port
+        self.on_drain = []
+        # ready - событие готовности обработчика, при остановке сбрасывается, чтобы /ready отдавал 503
+        self.ready = None
+        self.draining = threading.Event()
+        listen_fd = os.environ.pop(LISTEN_FD_ENV, None)
+        if listen_fd is None:
+            super().__init__(server_address, handler_class)
+        else:
+            super().__init__(server_address, handler_class, bind_and_activate=False)
+            self.socket.close()
+            self.socket = socket.socket(fileno=int(listen_fd))
+            self.server_address = self.socket.getsockname()
+            self.server_name = socket.getfqdn(self.server_address[0])
+            self.server_port = self.server_address[1]
+            logging.info('Listening socket %s inherited' % listen_fd)
+
+    def server_bind(self):
+        if self.reuse_port and hasattr(socket, 'SO_REUSEPORT'):
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        super().server_bind()
+
+    def install_signal_handlers(self, restart=True):
+        signal.signal(signal.SIGTERM, self.handle_stop_signal)
+        signal.signal(signal.SIGINT, self.handle_stop_signal)
+        signal.signal(signal.SIGHUP, self.handle_restart_signal if restart else signal.SIG_IGN)
+        # сигналы, пришедшие воркеру до этого момента, доставляются уже в обработчики
+        signal.pthread_sigmask(signal.SIG_UNBLOCK, STOP_SIGNALS)
+
+    def handle_stop_signal(self, signum, frame):
+        self.drain()
+
+    def handle_restart_signal(self, signum, frame):
+        self.spawn_successor()
+
+    def drain(self):
+        if self.draining.is_set():
+            return
+        self.draining.set()
+        if self.ready is not None:
+            self.ready.clear()
+        logging.info('Draining server')
+        # shutdown ждет выхода serve_forever, поэтому вызывается не из его потока
+        threading.Thread(target=self.shutdown, daemon=True).start()
+
+    def spawn_successor(self):
+        import subprocess
+        fd = self.socket.fileno()
+        os.set_inheritable(fd, True)
+        env = dict(os.environ, **{LISTEN_FD_ENV: str(fd), PARENT_PID_ENV: str(os.getpid())})
+        process = subprocess.Popen([sys.executable] + sys.argv, env=env, pass_fds=(fd,))
+        logging.info('Successor process %s started' % process.pid)
+        return process
+
+    def serve(self):
+        try:
+            self.serve_forever()
+        finally:
+            self.server_close()
+            for callback in self.on_drain:
+                try:
+                    callback()
+                except Exception as e:
+                    logging.exception('Drain callback failed: %s' % e)
+            logging.info('Server stopped')
+
+
+def fork_workers(server, count, run_worker, max_restarts=5, restart_window=60, backoff=0.5):
+    """Prefork: воркеры наследуют слушающий сокет и уже загруженные модули мастера.
+    run_worker(number) выполняется в дочернем процессе. Мастер пересылает SIGTERM воркерам,
+    по SIGHUP передает сокет новому мастеру, упавшие воркеры перезапускает с задержкой.
+    Если воркер не смог запуститься (SystemExit) или за restart_window секунд было больше
+    max_restarts перезапусков, мастер останавливает остальных воркеров и выходит с SystemExit."""
+    workers = {}
+    restarts = []
+    failed = []
+
+    def spawn(number):
+        # Воркер наследует заблокированные SIGTERM/SIGINT и не умирает от них до install_signal_handlers
+        mask = signal.pthread_sigmask(signal.SIG_BLOCK, STOP_SIGNALS)
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                run_worker(number)
+            except SystemExit as e:
+                logging.error('Worker %s cannot start: %s' % (number, e))
+                code = WORKER_STARTUP_FAILED
+            except BaseException:
+                logging.exception('Worker %s failed' % number)
+                code = 1
+            finally:
+                os._exit(code)
+        signal.pthread_sigmask(signal.SIG_SETMASK, mask)
+        workers[pid] = number
+
+    def stop_workers(signum, frame):
+        server.draining.set()
+        for pid in list(workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+
+    def give_up(reason):
+        logging.error('%s, stopping workers' % reason)
+        failed.append(reason)
+        stop_workers(None, None)
+
+    for number in range(count):
+        spawn(number)
+    # перезапущенные воркеры не должны повторно слать сигнал предыдущему мастеру
+    os.environ.pop(PARENT_PID_ENV, None)
+    signal.signal(signal.SIGTERM, stop_workers)
+    signal.signal(signal.SIGINT, stop_workers)
+    signal.signal(signal.SIGHUP, lambda signum, frame: server.spawn_successor())
+    logging.info('Started %s workers' % count)
+    while workers:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        number = workers.pop(pid, None)
+        if number is None or server.draining.is_set():
+            continue
+        if os.WIFEXITED(status) and os.WEXITSTATUS(status) == WORKER_STARTUP_FAILED:
+            give_up('Worker %s failed to start' % pid)
+            continue
+        now = time.monotonic()
+        restarts[:] = [started for started in restarts if now - started < restart_window]
+        if len(restarts) >= max_restarts:
+            give_up('Workers restarted %s times in %ss' % (len(restarts), restart_window))
+            continue
+        restarts.append(now)
+        logging.error('Worker %s exited with status %s, restarting' % (pid, status))
+        time.sleep(backoff * len(restarts))
+        if not server.draining.is_set():
+            spawn(number)
+    server.server_close()
+    logging.info('Server stopped')
+    if failed:
+        raise SystemExit(failed[0])
+
+
+def notify_parent_ready():
+    # Новый процесс готов: предыдущий может перестать принимать соединения
+    parent_pid = os.environ.pop(PARENT_PID_ENV, None)
+    if parent_pid:
+        try:
+            os.kill(int(parent_pid), signal.SIGTERM)
+        except OSError as e:
+            logging.error('Cannot notify parent process %s: %s' % (parent_pid, e))
@@ -1,7 +1,15 @@
+import time
+import queue
 import redis
+import bisect
+import random
+import hashlib
 import logging
 import functools
-from redis.exceptions import ConnectionError, TimeoutError
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from redis.exceptions import ConnectionError, TimeoutError, RedisError
 
 
 def reconnect():
@@ -24,11 +32,46 @@ def reconnect():
     return decorator
 
 
-class StorageRedis:
+class LocalCache:
+    # In-process кэш поверх Redis: key -> (value, время истечения)
 
-    def __init__(self, host='127.0.0.1', port=6379, retry_connection=3, timeout_connection=None):
-        self.redis = redis.Redis(host=host, port=port, socket_timeout=timeout_connection)
+    def __init__(self, ttl=60, max_size=100000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.data = {}
+
+    def get(self, key):
+        item = self.data.get(key)
+        if item is None:
+            return None
+        value, expire_at = item
+        if expire_at < time.monotonic():
+            self.data.pop(key, None)
+            return None
+        return value
+
+    def set(self, key, value, ttl=None):
+        if key not in self.data and len(self.data) >= self.max_size:
+            # вытесняем самую старую запись
+            self.data.pop(next(iter(self.data)), None)
+        self.data[key] = (value, time.monotonic() + (ttl or self.ttl))
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+    def __len__(self):
+        return len(self.data)
+
+
+class Storage:
+    # Общая часть хранилищ: in-process кэш, отложенная запись и операции поверх set/_get/_get_many
+
+    def __init__(self, retry_connection=3, local_cache_ttl=None, local_cache_size=100000):
         self.retry_connection = retry_connection
+        # local_cache_ttl - время жизни записей in-process кэша, None - кэш выключен
+        self.local_cache = LocalCache(ttl=local_cache_ttl, max_size=local_cache_size) if local_cache_ttl else None
+        # write_behind - очередь отложенной записи кэша (WriteBehind), None - запись синхронная
+        self.write_behind = None
 
     def cache_get(self, key):
         try:
@@ -37,22 +80,416 @@ class StorageRedis:
             logging.info(str(e))
             return None
 
-    def cache_set(self, key, score, cached_time):
+    def cache_set(self, key, score, cached_time, index_keys=()):
+        # index_keys - вторичные индексы (например по телефону), в которые добавляется key
+        if self.local_cache is not None:
+            # в in-process кэше скор живет не дольше его собственного ttl
+            self.local_cache.set(key, str(score), min(cached_time, self.local_cache.ttl))
+        if self.write_behind is not None:
+            return self.write_behind.put(key, score, cached_time, index_keys)
         try:
-            return self.set(key, score, cached_time)
+            # ключ и его индексы пишутся за один проход
+            entries = [(index_key, key, cached_time) for index_key in index_keys]
+            return self.set_many([(key, score, cached_time)], entries)[0]
         except (ConnectionError, TimeoutError) as e:
             logging.info(str(e))
             return None
 
+    def get(self, key):
+        if self.local_cache is not None:
+            value = self.local_cache.get(key)
+            if value is not None:
+                return value
+        value = self._get(key)
+        if value is not None and self.local_cache is not None:
+            self.local_cache.set(key, value)
+        return value
+
+    def get_many(self, keys):
+        # Пакетное чтение, возвращает список значений в порядке keys
+        if self.local_cache is None:
+            return self._get_many(keys)
+        values = [self.local_cache.get(key) for key in keys]
+        missing = [i for i, value in enumerate(values) if value is None]
+        if missing:
+            for i, value in zip(missing, self._get_many([keys[i] for i in missing])):
+                if value is not None:
+                    self.local_cache.set(keys[i], value)
+                values[i] = value
+        return values
+
+    def invalidate(self, index_keys):
+        """Удаляет все ключи из индексов index_keys вместе с самими индексами.
+        Возвращает число удаленных ключей."""
+        index_keys = list(index_keys)
+        if not index_keys:
+            return 0
+        keys = self.index_members(index_keys)
+        self.delete_many(list(keys) + index_keys)
+        return len(keys)
+
+
+class StorageRedis(Storage):
+
+    def __init__(self, host='127.0.0.1', port=6379, retry_connection=3, timeout_connection=None,
+                 local_cache_ttl=None, local_cache_size=100000):
+        super().__init__(retry_connection=retry_connection, local_cache_ttl=local_cache_ttl,
+                         local_cache_size=local_cache_size)
+        self.redis = redis.Redis(host=host, port=port, socket_timeout=timeout_connection)
+
     @reconnect()
     def set(self, key, value, ex=None):
         return self.redis.set(name=key, value=value, ex=ex)
 
     @reconnect()
-    def get(self, key):
+    def set_nx(self, key, value):
+        # Запись только если ключа еще нет, True - ключ записан
+        return bool(self.redis.set(name=key, value=value, nx=True))
+
+    @reconnect()
+    def _get(self, key):
         result = self.redis.get(key)
         return result.decode() if result else None
 
+    @reconnect()
+    def _get_many(self, keys):
+        # Чтение ключей из Redis одним pipeline
+        pipe = self.redis.pipeline(transaction=False)
+        for key in keys:
+            pipe.get(key)
+        return [result.decode() if result else None for result in pipe.execute()]
+
+    @reconnect()
+    def get_many_ttl(self, keys):
+        # Значения вместе с оставшимся временем жизни в секундах (None - без срока), одним pipeline
+        pipe = self.redis.pipeline(transaction=False)
+        for key in keys:
+            pipe.get(key)
+            pipe.ttl(key)
+        results = pipe.execute()
+        return [(value.decode() if value else None, ttl if ttl > 0 else None)
+                for value, ttl in zip(results[::2], results[1::2])]
+
+    @reconnect()
+    def set_many(self, items, index_entries=()):
+        # Пакетная запись одним pipeline, items - список (key, value, ex),
+        # index_entries - записи add_to_index, отправляются в том же pipeline
+        pipe = self.redis.pipeline(transaction=False)
+        for key, value, ex in items:
+            pipe.set(name=key, value=value, ex=ex)
+        self.pipe_index(pipe, index_entries)
+        return pipe.execute()[:len(items)]
+
+    @reconnect()
+    def scan_keys(self, prefix, count=1000, limit=None):
+        # limit - не больше стольких ключей, None - все ключи с префиксом
+        keys = self.redis.scan_iter(match=prefix + '*', count=count)
+        return [key.decode() for key in itertools.islice(keys, limit)]
+
+    @staticmethod
+    def pipe_index(pipe, entries):
+        # entries - список (index_key, key, ex): key добавляется в множество index_key,
+        # время жизни индекса продлевается до времени жизни самого нового ключа
+        for index_key, key, ex in entries:
+            pipe.sadd(index_key, key)
+            if ex:
+                pipe.expire(index_key, ex)
+
+    @reconnect()
+    def add_to_index(self, entries):
+        pipe = self.redis.pipeline(transaction=False)
+        self.pipe_index(pipe, entries)
+        return pipe.execute()
+
+    @reconnect()
+    def index_members(self, index_keys):
+        pipe = self.redis.pipeline(transaction=False)
+        for index_key in index_keys:
+            pipe.smembers(index_key)
+        return {member.decode() for members in pipe.execute() for member in members}
+
+    @reconnect()
+    def delete_many(self, keys):
+        if self.local_cache is not None:
+            for key in keys:
+                self.local_cache.delete(key)
+        if keys:
+            self.redis.delete(*keys)
+
     @reconnect()
     def delete(self, key):
+        if self.local_cache is not None:
+            self.local_cache.delete(key)
         self.redis.delete(key)
+
+
+class WriteBehind:
+    """Отложенная запись кэша: cache_set кладет запись в ограниченную очередь,
+    фоновый поток сбрасывает ее в store пачками по batch_size или раз в flush_interval секунд.
+    При переполнении очереди запись отбрасывается и учитывается в dropped.
+    Не чаще раза в log_interval секунд поток пишет в лог, сколько записей отброшено или не записано."""
+
+    def __init__(self, store, max_size=10000, batch_size=100, flush_interval=0.05, log_interval=60):
+        self.store = store
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.log_interval = log_interval
+        self.reported = (0, 0, 0)
+        self.reported_at = time.monotonic()
+        self.queue = queue.Queue(maxsize=max_size)
+        self.dropped = 0
+        self.failed = 0
+        self.flushed = 0
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.store.write_behind = self
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self
+
+    def put(self, key, value, ex=None, index_keys=()):
+        try:
+            self.queue.put_nowait((key, value, ex, tuple(index_keys)))
+            return True
+        except queue.Full:
+            with self.lock:
+                self.dropped += 1
+            return False
+
+    def take_batch(self, timeout):
+        batch = []
+        deadline = time.monotonic() + timeout
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def write(self, batch):
+        try:
+            entries = [(index_key, key, ex) for key, _, ex, index_keys in batch for index_key in index_keys]
+            self.store.set_many([(key, value, ex) for key, value, ex, _ in batch], entries)
+            self.flushed += len(batch)
+        except (ConnectionError, TimeoutError) as e:
+            logging.info(str(e))
+            self.failed += len(batch)
+        except RedisError as e:
+            # ошибка ответа (OOM, WRONGTYPE) не должна останавливать поток записи
+            logging.exception('Write-behind flush failed: %s' % e)
+            self.failed += len(batch)
+
+    def counters(self):
+        return self.flushed, self.failed, self.dropped
+
+    def report(self):
+        # Предупреждение только если с прошлого отчета были потери
+        counters = self.counters()
+        flushed, failed, dropped = [now - before for now, before in zip(counters, self.reported)]
+        if failed or dropped:
+            logging.warning('Write-behind: %s dropped, %s failed, %s flushed in %.0fs'
+                            % (dropped, failed, flushed, time.monotonic() - self.reported_at))
+        self.reported = counters
+        self.reported_at = time.monotonic()
+
+    def run(self):
+        while not self.stopped.is_set():
+            batch = self.take_batch(self.flush_interval)
+            if batch:
+                self.write(batch)
+            if time.monotonic() - self.reported_at >= self.log_interval:
+                self.report()
+
+    def flush(self):
+        # Синхронно сбросить все, что осталось в очереди
+        batch = self.take_batch(0)
+        while batch:
+            self.write(batch)
+            batch = self.take_batch(0)
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.store.write_behind = None
+        self.flush()
+        logging.info('Write-behind stopped: %s flushed, %s failed, %s dropped' % self.counters())
+
+
+class HashRing:
+    # Консистентное хэширование: каждый узел размещается на кольце vnodes виртуальными точками
+
+    def __init__(self, nodes, vnodes=160):
+        self.vnodes = vnodes
+        self.ring = {}
+        self.sorted_hashes = []
+        for node in nodes:
+            self.add_node(node)
+
+    @staticmethod
+    def hash(key):
+        return int(hashlib.md5(key.encode()).hexdigest()[:16], 16)
+
+    def add_node(self, node):
+        for i in range(self.vnodes):
+            point = self.hash('%s#%s' % (node, i))
+            self.ring[point] = node
+            bisect.insort(self.sorted_hashes, point)
+
+    def remove_node(self, node):
+        for i in range(self.vnodes):
+            point = self.hash('%s#%s' % (node, i))
+            del self.ring[point]
+            self.sorted_hashes.remove(point)
+
+    def get_node(self, key):
+        index = bisect.bisect(self.sorted_hashes, self.hash(key)) % len(self.sorted_hashes)
+        return self.ring[self.sorted_hashes[index]]
+
+
+def parse_node(node):
+    # 'host:port' -> ('host', port)
+    host, _, port = node.rpartition(':')
+    return host or '127.0.0.1', int(port)
+
+
+class Shard:
+    # Мастер и его реплики для чтения, у каждого узла свой reconnect/retry
+
+    def __init__(self, name, primary, replicas=()):
+        self.name = name
+        self.primary = primary
+        self.replicas = list(replicas)
+
+    def reader(self):
+        return random.choice(self.replicas) if self.replicas else self.primary
+
+
+class StorageRedisSharded(Storage):
+    """Хранилище поверх нескольких Redis: ключи распределяются по шардам консистентным хэшированием.
+
+    nodes - список строк 'host:port[,replica_host:replica_port...]', первый адрес - мастер.
+    Чтения ключей с префиксами replica_prefixes (интересы) идут на реплики.
+    """
+
+    def __init__(self, nodes, retry_connection=3, timeout_connection=None, local_cache_ttl=None,
+                 local_cache_size=100000, replica_prefixes=('i:',), max_workers=None):
+        super().__init__(retry_connection=retry_connection, local_cache_ttl=local_cache_ttl,
+                         local_cache_size=local_cache_size)
+        self.replica_prefixes = tuple(replica_prefixes)
+        self.shards = {}
+        for node in nodes:
+            addresses = [address.strip() for address in node.split(',') if address.strip()]
+            storages = [StorageRedis(*parse_node(address), retry_connection=retry_connection,
+                                     timeout_connection=timeout_connection) for address in addresses]
+            self.shards[addresses[0]] = Shard(addresses[0], storages[0], storages[1:])
+        self.ring = HashRing(self.shards)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers or len(self.shards))
+
+    def get_shard(self, key):
+        return self.shards[self.ring.get_node(key)]
+
+    def _read(self, shard, method, *args):
+        # Чтение с реплики, при ее недоступности - с мастера
+        node = shard.reader()
+        if node is not shard.primary:
+            try:
+                return getattr(node, method)(*args)
+            except (ConnectionError, TimeoutError) as e:
+                logging.info('Replica of %s unavailable: %s' % (shard.name, e))
+        return getattr(shard.primary, method)(*args)
+
+    def set(self, key, value, ex=None):
+        return self.get_shard(key).primary.set(key, value, ex)
+
+    def set_nx(self, key, value):
+        return self.get_shard(key).primary.set_nx(key, value)
+
+    def _get(self, key):
+        shard = self.get_shard(key)
+        if key.startswith(self.replica_prefixes):
+            return self._read(shard, '_get', key)
+        return shard.primary._get(key)
+
+    def read_many(self, shard, keys):
+        # Ключи replica_prefixes читаются с реплики, остальные - с мастера, как в _get
+        replica_keys = [key for key in keys if key.startswith(self.replica_prefixes)]
+        primary_keys = [key for key in keys if not key.startswith(self.replica_prefixes)]
+        values = {}
+        if replica_keys:
+            values.update(zip(replica_keys, self._read(shard, '_get_many', replica_keys)))
+        if primary_keys:
+            values.update(zip(primary_keys, shard.primary._get_many(primary_keys)))
+        return [values[key] for key in keys]
+
+    def _get_many(self, keys):
+        # Группируем ключи по шардам, читаем параллельно и собираем в исходном порядке
+        groups = self.group_by_shard(keys)
+        futures = {
+            name: self.executor.submit(self.read_many, self.shards[name], shard_keys)
+            for name, shard_keys in groups.items()
+        }
+        values = {}
+        for name, future in futures.items():
+            values.update(zip(groups[name], future.result()))
+        return [values[key] for key in keys]
+
+    def get_many_ttl(self, keys):
+        groups = self.group_by_shard(keys)
+        futures = {name: self.executor.submit(self.shards[name].primary.get_many_ttl, shard_keys)
+                   for name, shard_keys in groups.items()}
+        values = {}
+        for name, future in futures.items():
+            values.update(zip(groups[name], future.result()))
+        return [values[key] for key in keys]
+
+    def set_many(self, items, index_entries=()):
+        # Ключи и индексы группируются по шардам: на каждый шард один pipeline
+        groups = self.group_by_shard(items, key=lambda item: item[0])
+        index_groups = self.group_by_shard(index_entries, key=lambda entry: entry[0])
+        futures = {name: self.executor.submit(self.shards[name].primary.set_many,
+                                              groups.get(name, []), index_groups.get(name, []))
+                   for name in set(groups) | set(index_groups)}
+        return [result for name in groups for result in futures[name].result()]
+
+    def scan_keys(self, prefix, count=1000, limit=None):
+        futures = [self.executor.submit(shard.primary.scan_keys, prefix, count, limit)
+                   for shard in self.shards.values()]
+        keys = [key for future in futures for key in future.result()]
+        return keys if limit is None else keys[:limit]
+
+    def group_by_shard(self, items, key=lambda item: item):
+        groups = {}
+        for item in items:
+            groups.setdefault(self.get_shard(key(item)).name, []).append(item)
+        return groups
+
+    def add_to_index(self, entries):
+        groups = self.group_by_shard(entries, key=lambda entry: entry[0])
+        futures = [self.executor.submit(self.shards[name].primary.add_to_index, shard_entries)
+                   for name, shard_entries in groups.items()]
+        return [result for future in futures for result in future.result()]
+
+    def index_members(self, index_keys):
+        groups = self.group_by_shard(index_keys)
+        futures = [self.executor.submit(self.shards[name].primary.index_members, shard_keys)
+                   for name, shard_keys in groups.items()]
+        return {member for future in futures for member in future.result()}
+
+    def delete_many(self, keys):
+        if self.local_cache is not None:
+            for key in keys:
+                self.local_cache.delete(key)
+        futures = [self.executor.submit(self.shards[name].primary.delete_many, shard_keys)
+                   for name, shard_keys in self.group_by_shard(keys).items()]
+        for future in futures:
+            future.result()
+
+    def delete(self, key):
+        if self.local_cache is not None:
+            self.local_cache.delete(key)
+        self.get_shard(key).primary.delete(key)
@@ -0,0 +1,82 @@
+from pytest import fixture
+
+import interests
+from scoring import get_interests, get_interests_many
+from store import StorageRedis
+
+
+@fixture
+def storage_interests():
+    storage = StorageRedis()
+    storage.set('i:101', '["books", "hi-tech"]')
+    storage.set('i:102', '["tv", "pets"]')
+    storage.set('i:103', '[]')
+    yield storage
+    for key in storage.scan_keys('i:10') + storage.scan_keys('interests:dict:'):
+        storage.delete(key)
+    interests._dictionaries.clear()
+
+
+def test_encode_decode():
+    dictionary = ('books', 'hi-tech', 'music', 'pets', 'travel', 'tv')
+    value = interests.encode(['travel', 'music', 'travel'], 1, dictionary)
+    assert value == '#1:424'
+    interests._dictionaries[1] = dictionary
+    assert interests.decode(None, value) == ['travel', 'music', 'travel']
+    assert interests.decode(None, interests.encode([], 1, dictionary)) == []
+    interests._dictionaries.clear()
+
+
+def test_encode_wide_dictionary():
+    dictionary = tuple('interest%s' % i for i in range(20))
+    value = interests.encode(['interest19', 'interest2'], 1, dictionary)
+    assert value == '#1:1302'
+    interests._dictionaries[1] = dictionary
+    assert interests.decode(None, value) == ['interest19', 'interest2']
+    interests._dictionaries.clear()
+
+
+def test_decode_json():
+    assert interests.decode(None, '["books", "tv"]') == ['books', 'tv']
+    assert interests.decode(None, None) == []
+
+
+def test_migrate(storage_interests):
+    assert interests.migrate(storage_interests) == 3
+    assert storage_interests.get('i:101').startswith(interests.ENCODED_PREFIX)
+    assert get_interests(storage_interests, 101) == ['books', 'hi-tech']
+    assert dict(get_interests_many(storage_interests, [102, 103])) == {102: ['tv', 'pets'], 103: []}
+    # повторная миграция ничего не перезаписывает
+    assert interests.migrate(storage_interests) == 0
+
+
+def test_migrate_new_interests(storage_interests):
+    interests.migrate(storage_interests)
+    storage_interests.set('i:104', '["travel"]')
+    interests.migrate(storage_interests)
+    assert interests.current_version(storage_interests) == 2
+    assert get_interests(storage_interests, 101) == ['books', 'hi-tech']
+    assert get_interests(storage_interests, 104) == ['travel']
+
+
+def test_migrate_decode(storage_interests):
+    interests.migrate(storage_interests)
+    assert interests.migrate(storage_interests, to_encoded=False) == 3
+    assert storage_interests.get('i:102') == '["tv", "pets"]'
+
+
+def test_migrate_keeps_ttl(storage_interests):
+    storage_interests.set('i:104', '["travel"]', 100)
+    interests.migrate(storage_interests)
+    assert storage_interests.get('i:104').startswith(interests.ENCODED_PREFIX)
+    assert 0 < storage_interests.redis.ttl('i:104') <= 100
+    assert storage_interests.redis.ttl('i:101') == -1
+
+
+def test_publish_dictionary_conflict(storage_interests):
+    # другая миграция успела занять версию 1 своим словарем
+    storage_interests.set(interests.DICT_KEY % 1, '["pets"]')
+    version, dictionary = interests.publish_dictionary(storage_interests, ['books'])
+    assert (version, dictionary) == (2, ('pets', 'books'))
+    assert interests.load_dictionary(storage_interests, 1) == ('pets',)
+    assert interests.current_version(storage_interests) == 2
@@ -2,8 +2,9 @@ import pytest
 from pytest import fixture
 import redis
 
-from scoring import get_score, get_interests
-from store import StorageRedis
+from scoring import get_score, get_interests, get_interests_many
+from store import StorageRedis, WriteBehind
+from warmup import warm_up
 
 
 @fixture
@@ -24,6 +25,7 @@ def storage_redis_offline_mock(monkeypatch):
         raise redis.exceptions.ConnectionError
     monkeypatch.setattr(redis.Redis, 'get', mock_get_and_set_to_redis)
     monkeypatch.setattr(redis.Redis, 'set', mock_get_and_set_to_redis)
+    monkeypatch.setattr(redis.client.Pipeline, 'execute', mock_get_and_set_to_redis)
 
 
 def test_cache_set(storage_redis):
@@ -58,3 +60,74 @@ def test_get_interests_if_redis_offline(storage_redis, storage_redis_offline_moc
     with pytest.raises(redis.exceptions.ConnectionError):
         get_interests(storage_redis, 1)
 
+
+
+@fixture
+def storage_local_cache():
+    return StorageRedis(local_cache_ttl=60)
+
+
+def test_warm_up(storage_local_cache):
+    storage_local_cache.set('i:warm', '["books", "tv"]')
+    assert warm_up(storage_local_cache, prefixes=('i:warm',)) == 1
+    assert storage_local_cache.local_cache.get('i:warm') == '["books", "tv"]'
+    storage_local_cache.delete('i:warm')
+
+
+def test_warm_up_from_snapshot(storage_local_cache, tmp_path):
+    storage_local_cache.set('uid:warm', '3.0')
+    snapshot = tmp_path / 'snapshot'
+    snapshot.write_text('uid:warm\nuid:missing\n')
+    assert warm_up(storage_local_cache, snapshot=str(snapshot)) == 1
+    assert storage_local_cache.local_cache.get('uid:warm') == '3.0'
+    storage_local_cache.delete('uid:warm')
+
+
+def test_warm_up_if_redis_offline(storage_local_cache, monkeypatch):
+    def mock_scan_iter(*args, **kwargs):
+        raise redis.exceptions.ConnectionError
+    monkeypatch.setattr(redis.Redis, 'scan_iter', mock_scan_iter)
+    assert warm_up(storage_local_cache) == 0
+
+
+def test_write_behind_flush(storage_redis):
+    write_behind = WriteBehind(storage_redis, batch_size=2).start()
+    assert storage_redis.cache_set('uid:write_behind', 3.0, 30) is True
+    write_behind.stop()
+    assert storage_redis.get('uid:write_behind') == '3.0'
+    assert write_behind.flushed == 1
+    storage_redis.delete('uid:write_behind')
+
+
+def test_write_behind_overflow(storage_redis):
+    write_behind = WriteBehind(storage_redis, max_size=1)
+    storage_redis.write_behind = write_behind
+    assert storage_redis.cache_set('uid:write_behind1', 1.5, 30) is True
+    assert storage_redis.cache_set('uid:write_behind2', 1.5, 30) is False
+    assert write_behind.dropped == 1
+
+
+def test_write_behind_if_redis_offline(storage_redis, storage_redis_offline_mock, monkeypatch):
+    def mock_execute(*args, **kwargs):
+        raise redis.exceptions.ConnectionError
+    monkeypatch.setattr(redis.client.Pipeline, 'execute', mock_execute)
+    write_behind = WriteBehind(storage_redis).start()
+    score = get_score(storage_redis, phone="79173456253", email="otus@mail.ru")
+    write_behind.stop()
+    assert score == 3.0
+    assert write_behind.failed == 1
+
+
+def test_get_interests_many(storage_redis):
+    storage_redis.set('i:1', '["books", "tv"]')
+    result = list(get_interests_many(storage_redis, [1, 2, 1], batch_size=2))
+    assert result == [(1, ['books', 'tv']), (2, []), (1, ['books', 'tv'])]
+    storage_redis.delete('i:1')
+
+
+def test_get_interests_many_if_redis_offline(storage_redis, monkeypatch):
+    def mock_execute(*args, **kwargs):
+        raise redis.exceptions.ConnectionError
+    monkeypatch.setattr(redis.client.Pipeline, 'execute', mock_execute)
+    with pytest.raises(redis.exceptions.ConnectionError):
+        list(get_interests_many(storage_redis, [1, 2]))
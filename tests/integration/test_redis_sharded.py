@@ -0,0 +1,99 @@
+from pytest import fixture
+import redis
+
+from scoring import get_score, get_interests, invalidate_scores
+from store import HashRing, StorageRedisSharded
+
+# Для запуска нужны локальные redis-server на портах 6379, 6380 и 6381
+NODES = ['127.0.0.1:6379', '127.0.0.1:6380', '127.0.0.1:6381']
+
+
+@fixture
+def storage_sharded():
+    return StorageRedisSharded(NODES)
+
+
+@fixture
+def storage_sharded_replica():
+    # 6381 - реплика для шарда 6380 (redis-server --port 6381 --replicaof 127.0.0.1 6380)
+    return StorageRedisSharded(['127.0.0.1:6379', '127.0.0.1:6380,127.0.0.1:6381'])
+
+
+@fixture
+def storage_sharded_keys(storage_sharded):
+    keys = ['i:%s' % cid for cid in range(50)]
+    for key in keys:
+        storage_sharded.set(key, '["books"]')
+    yield storage_sharded, keys
+    for key in keys:
+        storage_sharded.delete(key)
+
+
+def test_hash_ring_stable():
+    ring = HashRing(NODES)
+    assert all(ring.get_node('uid:%s' % i) == HashRing(NODES).get_node('uid:%s' % i) for i in range(100))
+
+
+def test_hash_ring_remove_node_moves_only_its_keys():
+    ring = HashRing(NODES)
+    before = {i: ring.get_node('i:%s' % i) for i in range(1000)}
+    ring.remove_node(NODES[0])
+    after = {i: ring.get_node('i:%s' % i) for i in range(1000)}
+    assert all(before[i] == after[i] for i in before if before[i] != NODES[0])
+    assert NODES[0] not in after.values()
+
+
+def test_keys_spread_over_shards(storage_sharded_keys):
+    storage_sharded, keys = storage_sharded_keys
+    for shard in storage_sharded.shards.values():
+        assert any(shard.primary.get(key) for key in keys)
+
+
+def test_get_many(storage_sharded_keys):
+    storage_sharded, keys = storage_sharded_keys
+    assert storage_sharded.get_many(keys + ['i:missing']) == ['["books"]'] * len(keys) + [None]
+
+
+def test_get_interests(storage_sharded_keys):
+    storage_sharded, keys = storage_sharded_keys
+    assert get_interests(storage_sharded, 1) == ['books']
+
+
+def test_replica_fallback_to_primary(storage_sharded_replica, monkeypatch):
+    shard = storage_sharded_replica.shards['127.0.0.1:6380']
+    shard.primary.set('i:replica', '["tv"]')
+
+    def mock_get(*args, **kwargs):
+        raise redis.exceptions.ConnectionError
+    monkeypatch.setattr(shard.replicas[0].redis, 'get', mock_get)
+    monkeypatch.setattr(shard, 'reader', lambda: shard.replicas[0])
+    assert storage_sharded_replica._read(shard, '_get', 'i:replica') == '["tv"]'
+    shard.primary.delete('i:replica')
+
+
+def test_get_score_if_redis_offline(storage_sharded, monkeypatch):
+    def mock_get_and_set_to_redis(*args, **kwargs):
+        raise redis.exceptions.ConnectionError
+    monkeypatch.setattr(redis.Redis, 'get', mock_get_and_set_to_redis)
+    monkeypatch.setattr(redis.Redis, 'set', mock_get_and_set_to_redis)
+    monkeypatch.setattr(redis.client.Pipeline, 'execute', mock_get_and_set_to_redis)
+    assert get_score(storage_sharded, phone="79173456253", email="otus@mail.ru") == 3.0
+
+
+def test_invalidate_scores(storage_sharded):
+    for phone in ('79175002040', '79175002041', '79175002042'):
+        get_score(storage_sharded, phone=phone, email="otus@mail.ru")
+    assert invalidate_scores(storage_sharded, [{"email": "otus@mail.ru"}]) == 3
+    assert storage_sharded.scan_keys('uid:') == []
+    storage_sharded.delete_many(storage_sharded.scan_keys('idx:'))
+
+
+def test_get_many_reads_scores_from_primary(storage_sharded_replica, monkeypatch):
+    shard = storage_sharded_replica.shards['127.0.0.1:6380']
+    monkeypatch.setattr(shard, 'reader', lambda: shard.replicas[0])
+    replica_reads = []
+    monkeypatch.setattr(shard.replicas[0], '_get_many', lambda keys: replica_reads.extend(keys) or [None] * len(keys))
+    keys = [key for key in ('uid:%s' % i for i in range(50)) if storage_sharded_replica.get_shard(key) is shard]
+    keys += [key for key in ('i:%s' % i for i in range(50)) if storage_sharded_replica.get_shard(key) is shard]
+    storage_sharded_replica.get_many(keys)
+    assert replica_reads and all(key.startswith('i:') for key in replica_reads)
@@ -0,0 +1,146 @@
+import time
+import logging
+
+import pytest
+import redis
+
+from fake_store import FakeStorageRedis, FakeClock
+from scoring import get_score, get_interests, get_interests_many
+from store import WriteBehind
+from warmup import warm_up
+
+
+class TestFakeStorageRedis:
+    def test_get_set(self):
+        store = FakeStorageRedis()
+        assert store.cache_set('key', 'value', 30) is True
+        assert store.get('key') == 'value'
+        store.delete('key')
+        assert store.get('key') is None
+
+    def test_local_cache_ttl(self):
+        store = FakeStorageRedis(local_cache_ttl=60)
+        store.cache_set('uid:key', 3.0, 60 * 60)
+        _, expire_at = store.local_cache.data['uid:key']
+        assert expire_at - time.monotonic() <= 60
+
+    def test_warm_up_limited_by_cache_size(self):
+        store = FakeStorageRedis(local_cache_ttl=60, local_cache_size=3)
+        for cid in range(10):
+            store.set('i:%s' % cid, '["books"]')
+            store.set('uid:%s' % cid, '1.5')
+        assert warm_up(store) == 3
+        assert len(store.local_cache) == 3
+
+    def test_wrong_type(self):
+        store = FakeStorageRedis()
+        store.add_to_index([('idx:phone:1', 'uid:1', 30)])
+        store.set('uid:1', '1.5')
+        with pytest.raises(redis.exceptions.ResponseError):
+            store.get('idx:phone:1')
+        with pytest.raises(redis.exceptions.ResponseError):
+            store.add_to_index([('uid:1', 'uid:2', 30)])
+        assert store.index_members(['idx:phone:1']) == {'uid:1'}
+
+    def test_cache_set_one_round_trip(self):
+        store = FakeStorageRedis()
+        assert store.cache_set('uid:1', 1.5, 30, index_keys=['idx:phone:1', 'idx:email:a@b.ru']) is True
+        assert store.redis.stats['calls'] == {'pipeline': 1}
+        assert store.index_members(['idx:phone:1', 'idx:email:a@b.ru']) == {'uid:1'}
+
+    def test_expire(self):
+        clock = FakeClock()
+        store = FakeStorageRedis(clock=clock)
+        store.set('key', 'value', 30)
+        clock.sleep(31)
+        assert store.get('key') is None
+
+    def test_latency(self):
+        store = FakeStorageRedis(latency={'get': ('constant', 0.005), '*': ('uniform', 0.001, 0.002)})
+        store.get('key')
+        store.set('key', 'value')
+        assert 0.006 <= store.redis.clock.time() <= 0.007
+
+    def test_reproducible(self):
+        def run(seed):
+            store = FakeStorageRedis(seed=seed, latency={'*': ('expovariate', 1000)}, error_rate={'get': 0.3})
+            for cid in range(100):
+                try:
+                    get_interests(store, cid)
+                except redis.exceptions.ConnectionError:
+                    pass
+            return store.redis.stats
+        assert run(1) == run(1)
+        assert run(1) != run(2)
+
+    def test_reconnect(self):
+        store = FakeStorageRedis(retry_connection=3, error_rate={'get': 1})
+        with pytest.raises(redis.exceptions.ConnectionError):
+            store.get('key')
+        assert store.redis.stats['calls']['get'] == 4
+
+    def test_timeout(self):
+        store = FakeStorageRedis(retry_connection=2, timeout_rate={'get': 1}, socket_timeout=0.5)
+        assert store.cache_get('key') is None
+        assert store.redis.stats['timeouts'] == 3
+        assert store.redis.clock.time() == 1.5
+
+    def test_partition(self):
+        store = FakeStorageRedis(retry_connection=0)
+        store.set('i:1', '["books"]')
+        store.redis.partition(duration=10)
+        assert get_score(store, phone="79173456253", email="otus@mail.ru") == 3.0
+        with pytest.raises(redis.exceptions.ConnectionError):
+            get_interests(store, 1)
+        store.redis.clock.sleep(10)
+        assert dict(get_interests_many(store, [1])) == {1: ['books']}
+
+    def test_write_behind_if_redis_offline(self):
+        store = FakeStorageRedis(retry_connection=0, error_rate={'pipeline': 1})
+        write_behind = WriteBehind(store).start()
+        get_score(store, phone="79173456253", email="otus@mail.ru")
+        write_behind.stop()
+        assert write_behind.failed == 1
+
+    def test_write_behind_reports_dropped(self, caplog):
+        caplog.set_level(logging.INFO)
+        store = FakeStorageRedis()
+        write_behind = WriteBehind(store, max_size=1)
+        store.write_behind = write_behind
+        store.cache_set('uid:1', 1.5, 30)
+        store.cache_set('uid:2', 1.5, 30)
+        write_behind.report()
+        assert '1 dropped, 0 failed, 0 flushed' in caplog.text
+        caplog.clear()
+        write_behind.report()
+        assert caplog.text == ''
+        write_behind.stop()
+        assert 'Write-behind stopped: 1 flushed, 0 failed, 1 dropped' in caplog.text
+
+    def test_write_behind_survives_response_error(self, monkeypatch):
+        store = FakeStorageRedis()
+        write_behind = WriteBehind(store, flush_interval=0.01).start()
+
+        def mock_set_many(items, index_entries=()):
+            raise redis.exceptions.ResponseError('OOM command not allowed')
+        monkeypatch.setattr(store, 'set_many', mock_set_many)
+        get_score(store, phone="79173456253", email="otus@mail.ru")
+        for _ in range(100):
+            if write_behind.failed:
+                break
+            time.sleep(0.01)
+        assert write_behind.failed == 1
+        assert write_behind.thread.is_alive()
+        monkeypatch.undo()
+        get_score(store, phone="79173456254", email="otus@mail.ru")
+        write_behind.stop()
+        assert write_behind.failed == 1
+        assert write_behind.flushed == 1
+        assert write_behind.dropped == 0
+
+    def test_get_many_ttl(self):
+        store = FakeStorageRedis()
+        store.set('i:1', '["books"]', 100)
+        store.set('i:2', '["tv"]')
+        store.redis.clock.sleep(40)
+        assert store.get_many_ttl(['i:1', 'i:2', 'i:3']) == [('["books"]', 60), ('["tv"]', None), (None, None)]
@@ -0,0 +1,91 @@
+import hashlib
+import json
+import socket
+import threading
+from http.server import HTTPServer
+
+import pytest
+
+import api
+from fake_store import FakeStorageRedis
+
+
+@pytest.fixture
+def server(monkeypatch):
+    store = FakeStorageRedis()
+    store.set('i:1', '["books", "tv"]')
+    monkeypatch.setattr(api.MainHTTPHandler, 'store', store)
+    monkeypatch.setattr(api.MainHTTPHandler, 'max_body_size', 1024)
+    server = HTTPServer(("localhost", 0), api.MainHTTPHandler)
+    thread = threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def send(server, headers, body=b'', close_write=False):
+    # Сырой HTTP запрос, чтобы можно было послать любой Content-Length
+    with socket.create_connection(server.server_address, timeout=5) as sock:
+        head = 'POST /method HTTP/1.1\r\nHost: localhost\r\n'
+        head += ''.join('%s: %s\r\n' % item for item in headers.items()) + '\r\n'
+        sock.sendall(head.encode() + body)
+        if close_write:
+            sock.shutdown(socket.SHUT_WR)
+        response = b''
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            response += chunk
+    status = int(response.split(b' ', 2)[1])
+    return status, json.loads(response.split(b'\r\n\r\n', 1)[1])
+
+
+def interests_request(client_ids):
+    request = {"account": "horns&hoofs", "login": "h&f", "method": "clients_interests",
+               "arguments": {"client_ids": client_ids}}
+    request["token"] = hashlib.sha512((request["account"] + request["login"] + api.SALT).encode()).hexdigest()
+    return json.dumps(request).encode()
+
+
+class TestMainHTTPHandler:
+    def test_ok(self, server):
+        body = interests_request([1, 2])
+        code, response = send(server, {'Content-Length': len(body)}, body)
+        assert code == api.OK
+        assert response == {"code": api.OK, "response": {"client_id1": ["books", "tv"], "client_id2": []}}
+
+    def test_body_too_large(self, server):
+        body = interests_request(list(range(1000)))
+        code, response = send(server, {'Content-Length': len(body)}, body)
+        assert code == api.REQUEST_ENTITY_TOO_LARGE
+        assert response["code"] == api.REQUEST_ENTITY_TOO_LARGE
+
+    def test_body_larger_than_socket_buffers(self, server):
+        # Без вычитывания тела клиент получал бы BrokenPipeError/ConnectionResetError
+        body = b'x' * (10 * 1024 * 1024)
+        for _ in range(3):
+            code, response = send(server, {'Content-Length': len(body)}, body)
+            assert code == api.REQUEST_ENTITY_TOO_LARGE
+
+    @pytest.mark.parametrize("headers", [{}, {'Content-Length': -1}, {'Content-Length': 'abc'}])
+    def test_bad_length(self, server, headers):
+        code, response = send(server, headers, close_write=True)
+        assert code == api.BAD_REQUEST
+
+    def test_short_body(self, server):
+        body = interests_request([1])
+        code, response = send(server, {'Content-Length': len(body) + 10}, body, close_write=True)
+        assert code == api.BAD_REQUEST
+
+    def test_invalid_json(self, server):
+        code, response = send(server, {'Content-Length': 5}, b'{bad}')
+        assert code == api.BAD_REQUEST
+
+    def test_buffer_reused(self, server):
+        for client_ids in ([1, 2, 3], [1]):
+            body = interests_request(client_ids)
+            code, response = send(server, {'Content-Length': len(body)}, body)
+            assert code == api.OK
+            assert len(response["response"]) == len(client_ids)
@@ -0,0 +1,75 @@
+from fake_store import FakeStorageRedis
+from precompute import refresh_scores, ScorePrecomputer
+from scoring import get_score, invalidate_scores, ScoringModel, DEFAULT_MODEL
+from store import WriteBehind
+
+
+def uid_keys(store):
+    return store.scan_keys('uid:')
+
+
+class TestScoreIndex:
+    def test_email_and_gender_in_key(self):
+        store = FakeStorageRedis()
+        assert get_score(store, "79175002040", None) == 1.5
+        assert get_score(store, "79175002040", "otus@mail.ru") == 3.0
+        assert len(uid_keys(store)) == 2
+
+    def test_invalidate_by_phone(self):
+        store = FakeStorageRedis()
+        get_score(store, "79175002040", None, first_name="a", last_name="b")
+        get_score(store, "79175002040", "otus@mail.ru")
+        get_score(store, "79991112233", None)
+        assert invalidate_scores(store, [{"phone": "79175002040"}]) == 2
+        assert len(uid_keys(store)) == 1
+        assert store.scan_keys('idx:phone:79175002040') == []
+
+    def test_invalidate_by_email_bulk(self):
+        store = FakeStorageRedis()
+        get_score(store, None, "Otus@mail.ru", first_name="a", last_name="b")
+        get_score(store, "79991112233", None)
+        customers = [{"email": "otus@mail.ru"}, {"phone": "79991112233"}, {"phone": "79000000000"}]
+        assert invalidate_scores(store, customers) == 2
+        assert uid_keys(store) == []
+        assert store.redis.stats['calls']['pipeline'] == 2 + 1
+
+    def test_invalidate_local_cache(self):
+        store = FakeStorageRedis(local_cache_ttl=60)
+        model = ScoringModel(DEFAULT_MODEL)
+        get_score(store, "79175002040", None, model=model)
+        invalidate_scores(store, [{"phone": "79175002040"}])
+        assert len(store.local_cache) == 0
+
+    def test_write_behind_index(self):
+        store = FakeStorageRedis()
+        write_behind = WriteBehind(store).start()
+        get_score(store, "79175002040", "otus@mail.ru")
+        write_behind.stop()
+        assert invalidate_scores(store, [{"email": "otus@mail.ru"}]) == 1
+
+
+class TestPrecompute:
+    def test_refresh_scores(self):
+        store = FakeStorageRedis()
+        get_score(store, "79175002040", None)
+        customer = {"phone": 79175002040, "email": "otus@mail.ru", "birthday": "01.01.2000", "gender": 1}
+        assert refresh_scores(store, [customer]) == 1
+        keys = uid_keys(store)
+        assert len(keys) == 1
+        assert store.get(keys[0]) == '4.5'
+
+    def test_precomputer(self):
+        store = FakeStorageRedis()
+        precomputer = ScorePrecomputer(store, batch_size=2)
+        precomputer.start()
+        for phone in ("79175002040", "79175002041", "79175002042"):
+            assert precomputer.submit({"phone": phone, "first_name": "a", "last_name": "b"}) is True
+        precomputer.stop()
+        assert precomputer.refreshed == 3
+        assert len(uid_keys(store)) == 3
+
+    def test_precomputer_overflow(self):
+        precomputer = ScorePrecomputer(FakeStorageRedis(), max_size=1)
+        assert precomputer.submit({"phone": "79175002040"}) is True
+        assert precomputer.submit({"phone": "79175002041"}) is False
+        assert precomputer.dropped == 1
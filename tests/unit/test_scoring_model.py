@@ -0,0 +1,110 @@
+import os
+import json
+import time
+from datetime import datetime
+
+import pytest
+
+import scoring
+from scoring import ScoringModel, ModelReloader, DEFAULT_MODEL, get_score
+
+
+class StoreMock:
+    def __init__(self):
+        self.data = {}
+
+    def cache_get(self, key):
+        return self.data.get(key)
+
+    def cache_set(self, key, score, cached_time, index_keys=()):
+        self.data[key] = score
+
+
+class TestScoringModel:
+    @pytest.mark.parametrize("values, score", [
+        (("79175002040", "otus@mail.ru", None, None, None, None), 3.0),
+        ((None, None, datetime(2000, 1, 1), 1, "a", "b"), 2.0),
+        ((None, None, datetime(2000, 1, 1), 0, None, None), 0),
+        (("79175002040", "otus@mail.ru", datetime(2000, 1, 1), 1, "a", "b"), 5.0),
+    ])
+    def test_default_model(self, values, score):
+        assert ScoringModel(DEFAULT_MODEL).score(*values) == score
+
+    @pytest.mark.parametrize("config", [
+        {"rules": []},
+        {"version": "2", "rules": [{"fields": ["age"], "weight": 1}]},
+        {"version": "2", "rules": [{"fields": [], "weight": 1}]},
+        {"version": "2", "rules": [{"fields": ["phone"], "weight": "1"}]},
+        [1, 2],
+        {"version": "2", "rules": ["x"]},
+        {"version": "2", "rules": {"fields": ["phone"]}},
+        {"version": "2", "rules": [{"fields": "phone", "weight": 1}]},
+    ])
+    def test_invalid_model(self, config):
+        with pytest.raises(ValueError):
+            ScoringModel(config)
+
+    def test_model_version_in_cache_key(self):
+        store = StoreMock()
+        model = ScoringModel({"version": "2", "rules": [{"fields": ["phone"], "weight": 10}]})
+        assert get_score(store, "79175002040", None) == 1.5
+        assert get_score(store, "79175002040", None, model=model) == 10
+        assert sorted(key.split(':')[1].split('-')[0] for key in store.data) == ['1', '2']
+
+    def test_rules_in_cache_key(self):
+        store = StoreMock()
+        model = ScoringModel({"version": "1", "rules": [{"fields": ["phone"], "weight": 10}]})
+        assert get_score(store, "79175002040", None) == 1.5
+        assert get_score(store, "79175002040", None, model=model) == 10
+        assert len(store.data) == 2
+        # ключ не зависит от процесса: та же модель дает ту же cache_version
+        same = ScoringModel({"version": "1", "rules": [{"fields": ["phone"], "weight": 10}]})
+        assert same.cache_version == model.cache_version
+
+
+class TestModelReloader:
+    def test_reload(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(scoring, '_model', ScoringModel(DEFAULT_MODEL))
+        path = tmp_path / 'model.json'
+        path.write_text(json.dumps({"version": "2", "rules": [{"fields": ["email"], "weight": 4}]}))
+        reloader = ModelReloader(str(path))
+        assert reloader.reload() is True
+        assert scoring.get_model().version == "2"
+        assert get_score(StoreMock(), None, "otus@mail.ru") == 4
+        # файл не менялся
+        assert reloader.reload() is False
+
+    def test_reload_invalid_keeps_model(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(scoring, '_model', ScoringModel(DEFAULT_MODEL))
+        path = tmp_path / 'model.json'
+        path.write_text('{"version": "2", "rules": [{"fields": ["age"], "weight": 4}]}')
+        assert ModelReloader(str(path)).reload() is False
+        assert scoring.get_model().version == "1"
+
+    def test_reload_same_version_changed_rules(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(scoring, '_model', ScoringModel(DEFAULT_MODEL))
+        path = tmp_path / 'model.json'
+        path.write_text(json.dumps(DEFAULT_MODEL))
+        reloader = ModelReloader(str(path))
+        assert reloader.reload() is True
+        path.write_text(json.dumps({"version": "1", "rules": [{"fields": ["email"], "weight": 4}]}))
+        os.utime(str(path), (time.time() + 10, time.time() + 10))
+        assert reloader.reload() is True
+        assert scoring.get_model().cache_version != ScoringModel(DEFAULT_MODEL).cache_version
+
+    def test_reload_thread_survives_invalid_model(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(scoring, '_model', ScoringModel(DEFAULT_MODEL))
+        path = tmp_path / 'model.json'
+        path.write_text('[1, 2]')
+        reloader = ModelReloader(str(path), interval=0.01)
+        reloader.start()
+        time.sleep(0.05)
+        assert reloader.is_alive()
+        path.write_text(json.dumps({"version": "3", "rules": [{"fields": ["email"], "weight": 4}]}))
+        os.utime(str(path), (time.time() + 10, time.time() + 10))
+        for _ in range(100):
+            if scoring.get_model().version == "3":
+                break
+            time.sleep(0.01)
+        reloader.stop()
+        assert scoring.get_model().version == "3"
@@ -0,0 +1,72 @@
+import signal
+import threading
+from http.server import BaseHTTPRequestHandler
+
+import pytest
+
+from server import GracefulHTTPServer, fork_workers
+
+
+class TestGracefulHTTPServer:
+    def test_drain(self):
+        server = GracefulHTTPServer(("localhost", 0), BaseHTTPRequestHandler)
+        server.ready = threading.Event()
+        server.ready.set()
+        drained = []
+        server.on_drain.append(lambda: drained.append(True))
+        thread = threading.Thread(target=server.serve)
+        thread.start()
+        server.drain()
+        thread.join(timeout=5)
+        assert not thread.is_alive()
+        assert not server.ready.is_set()
+        assert drained == [True]
+
+    def test_drain_callback_error(self):
+        server = GracefulHTTPServer(("localhost", 0), BaseHTTPRequestHandler)
+        drained = []
+
+        def fail():
+            raise RuntimeError
+        server.on_drain.extend([fail, lambda: drained.append(True)])
+        thread = threading.Thread(target=server.serve)
+        thread.start()
+        server.drain()
+        thread.join(timeout=5)
+        assert drained == [True]
+
+
+@pytest.fixture
+def signal_handlers():
+    # fork_workers ставит обработчики сигналов в процессе pytest
+    signums = (signal.SIGTERM, signal.SIGINT, signal.SIGHUP)
+    handlers = {signum: signal.getsignal(signum) for signum in signums}
+    yield
+    for signum, handler in handlers.items():
+        signal.signal(signum, handler)
+
+
+class TestForkWorkers:
+    def test_startup_failure_is_fatal(self, tmp_path, signal_handlers):
+        server = GracefulHTTPServer(("localhost", 0), BaseHTTPRequestHandler)
+        started = tmp_path / 'started'
+
+        def run_worker(number):
+            with open(str(started), 'a') as f:
+                f.write('%s\n' % number)
+            raise SystemExit('Cannot load scoring model')
+        with pytest.raises(SystemExit):
+            fork_workers(server, 2, run_worker, backoff=0)
+        assert sorted(started.read_text().split()) == ['0', '1']
+
+    def test_restart_limit(self, tmp_path, signal_handlers):
+        server = GracefulHTTPServer(("localhost", 0), BaseHTTPRequestHandler)
+        started = tmp_path / 'started'
+
+        def run_worker(number):
+            with open(str(started), 'a') as f:
+                f.write('%s\n' % number)
+            raise RuntimeError
+        with pytest.raises(SystemExit):
+            fork_workers(server, 1, run_worker, max_restarts=2, backoff=0)
+        assert started.read_text().split() == ['0', '0', '0']
@@ -0,0 +1,39 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+import api
+from store import StorageRedis, StorageRedisSharded
+
+
+class TestStartup:
+    def test_import_is_lazy(self):
+        code = "import sys, api; print(sorted(m for m in ('redis', 'dateutil', 'store') if m in sys.modules))"
+        output = subprocess.check_output([sys.executable, '-c', code], cwd=os.path.dirname(api.__file__))
+        assert output.strip() == b'[]'
+
+    def test_create_store_from_options(self):
+        store = api.create_store(api.parse_options(['--redis-host', '10.0.0.1', '--redis-port', '6380',
+                                                    '--local-cache-ttl', '30', '--local-cache-size', '500']))
+        assert isinstance(store, StorageRedis)
+        assert store.redis.connection_pool.connection_kwargs['host'] == '10.0.0.1'
+        assert store.redis.connection_pool.connection_kwargs['port'] == 6380
+        assert store.local_cache.ttl == 30
+        assert store.local_cache.max_size == 500
+
+    def test_create_sharded_store_from_options(self):
+        store = api.create_store(api.parse_options(['--redis-node', '127.0.0.1:6379',
+                                                    '--redis-node', '127.0.0.1:6380']))
+        assert isinstance(store, StorageRedisSharded)
+        assert sorted(store.shards) == ['127.0.0.1:6379', '127.0.0.1:6380']
+
+    @pytest.mark.parametrize('argv', [
+        ['--workers', '2', '--scoring-model', 'missing.json'],
+        ['--workers', '2', '--redis-node', '127.0.0.1:port'],
+        ['--workers', '2', '--redis-node', ','],
+    ])
+    def test_check_options(self, argv):
+        with pytest.raises(SystemExit):
+            api.check_options(api.parse_options(argv))
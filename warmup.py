@@ -0,0 +1,47 @@
+import logging
+import time
+
+
+WARMUP_PREFIXES = ('uid:', 'i:')
+WARMUP_BATCH_SIZE = 500
+
+
+def read_snapshot(path):
+    # Файл снапшота - список горячих ключей, по одному в строке
+    with open(path) as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def collect_keys(store, prefixes=WARMUP_PREFIXES, snapshot=None, limit=None):
+    # limit - сколько ключей поместится в local_cache, остальные читать бесполезно
+    if snapshot:
+        return read_snapshot(snapshot)[:limit]
+    keys = []
+    for prefix in prefixes:
+        if limit is not None and len(keys) >= limit:
+            break
+        keys.extend(store.scan_keys(prefix, limit=None if limit is None else limit - len(keys)))
+    return keys
+
+
+def warm_up(store, prefixes=WARMUP_PREFIXES, snapshot=None, batch_size=WARMUP_BATCH_SIZE):
+    """Прогрев in-process кэша store: ключи берутся из снапшота или SCAN по префиксам,
+    но не больше размера кэша, значения читаются пачками через pipeline.
+    Возвращает число загруженных ключей."""
+    from redis.exceptions import ConnectionError, TimeoutError
+    if store.local_cache is None:
+        logging.info('Warm-up skipped, local cache is disabled')
+        return 0
+    started = time.monotonic()
+    try:
+        keys = collect_keys(store, prefixes, snapshot, limit=store.local_cache.max_size)
+        loaded = 0
+        for i in range(0, len(keys), batch_size):
+            batch = keys[i:i + batch_size]
+            # get_many сам кладет прочитанные значения в local_cache
+            loaded += sum(value is not None for value in store.get_many(batch))
+    except (ConnectionError, TimeoutError, OSError) as e:
+        logging.error('Warm-up failed: %s' % e)
+        return 0
+    logging.info('Warm-up loaded %s keys in %.2fs' % (loaded, time.monotonic() - started))
+    return loaded